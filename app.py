@@ -1,7 +1,14 @@
 import gradio as gr
 import os
+import asyncio
 import json
+import pickle
+import hashlib
+import diskcache
 import docx
+import faiss
+import numpy as np
+from functools import lru_cache
 from docx.shared import RGBColor
 from dotenv import load_dotenv
 
@@ -9,10 +16,13 @@ from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain.prompts import PromptTemplate
+from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chains import create_retrieval_chain
 from langchain_core.documents import Document
 
+from retrieval import FilteredFallbackRetriever, normalize_text, build_rag_chain
+from checklists import DOCUMENT_CHECKLISTS, CHECKLIST_AUTOMATA, GENERAL_PROCESS, REFERENCE_KIND, build_keyword_automaton, infer_kind
+
 # --- 1. CONFIGURATION & INITIALIZATION ---
 load_dotenv()
 
@@ -24,34 +34,119 @@ if not os.getenv("GOOGLE_API_KEY"):
 if not os.path.exists("faiss_index"):
     raise FileNotFoundError("FAISS index not found. Please run 'create_vector_store.py' first.")
 
-# Initialize LLM and Embeddings
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-pro-latest", temperature=0.2, convert_system_message_to_human=True)
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-
-# Load the FAISS vector store
-db = FAISS.load_local("faiss_index", embeddings, allow_dangerous_deserialization=True)
-retriever = db.as_retriever(search_kwargs={"k": 5}) # Use 5 relevant chunks
-
-# --- 2. DOCUMENT CHECKLIST & PROCESS IDENTIFICATION ---
-DOCUMENT_CHECKLISTS = {
-    "Company Incorporation": {
-        "required_count": 5,
-        "documents": {
-            "articles of association": "Articles of Association",
-            "memorandum of association": "Memorandum of Association (MoA/MoU)",
-            "incorporation application form": "Incorporation Application Form",
-            "ubo declaration form": "UBO Declaration Form",
-            "register of members and directors": "Register of Members and Directors"
-        }
+# Gemini's JSON mode constrains the answer to this schema: a list of issues, with no surrounding prose
+ISSUE_LIST_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "section": {"type": "string", "description": "The clause or section number, e.g., 'Clause 3.1'"},
+            "offending_text": {"type": "string", "description": "The exact text from the document that contains the issue."},
+            "issue": {"type": "string", "description": "A clear, one-sentence description of the issue found."},
+            "severity": {"type": "string", "enum": ["High", "Medium", "Low"]},
+            "suggestion": {"type": "string", "description": "A compliant suggestion or an action to be taken."},
+            "citation": {"type": "string", "description": "The specific ADGM rule that applies, based on the context."}
+        },
+        "required": ["section", "offending_text", "issue", "severity", "suggestion", "citation"]
     }
 }
 
+# Initialize LLMs
+# Flash handles most documents; Pro is reserved for long documents or when Flash gives a weak answer
+llm_flash = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", temperature=0.2, convert_system_message_to_human=True,
+                                   response_mime_type="application/json", response_schema=ISSUE_LIST_SCHEMA)
+llm_pro = ChatGoogleGenerativeAI(model="gemini-1.5-pro-latest", temperature=0.2, convert_system_message_to_human=True,
+                                 response_mime_type="application/json", response_schema=ISSUE_LIST_SCHEMA)
+
+# The embeddings client and FAISS vector store are process-wide lazy singletons:
+# only the first request in each worker pays the cost of loading the index.
+@lru_cache(maxsize=1)
+def get_embeddings():
+    return GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+
+def read_faiss_index(path):
+    """
+    Opens the index read-only and memory-mapped where FAISS supports it. Only IVF inverted lists are mapped,
+    so the IVF+PQ codes of large knowledge bases are shared across workers through the OS page cache; flat
+    indexes, such as the int8 one used below 10k chunks (a few MB), are still read into each process.
+    """
+    try:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except Exception as e:
+        print(f"Could not memory-map the FAISS index, reading it into process memory: {e}")
+        return faiss.read_index(path)
+
+@lru_cache(maxsize=1)
+def get_db():
+    # Built directly from the files FAISS.save_local wrote, instead of load_local, which would first read
+    # the whole index into memory
+    index = read_faiss_index(os.path.join("faiss_index", "index.faiss"))
+    with open(os.path.join("faiss_index", "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f) # Our own trusted file, as with allow_dangerous_deserialization
+    db = FAISS(embedding_function=get_embeddings(), index=index, docstore=docstore, index_to_docstore_id=index_to_docstore_id)
+    if os.environ.get("FAISS_GPU"):
+        db.index = move_index_to_gpu(db.index)
+    return db
+
+def move_index_to_gpu(cpu_index):
+    """Copies the index to GPU 0 (requires faiss-gpu); keeps the CPU index if that isn't possible."""
+    if not hasattr(faiss, "StandardGpuResources"):
+        print("FAISS_GPU is set but this FAISS build has no GPU support; using the CPU index.")
+        return cpu_index
+    if isinstance(cpu_index, faiss.IndexScalarQuantizer):
+        # Flat int8 indexes aren't implemented on GPU; decode the (small, <10k) corpus into a GPU flat index
+        flat_index = faiss.IndexFlatL2(cpu_index.d)
+        flat_index.add(cpu_index.reconstruct_n(0, cpu_index.ntotal))
+        cpu_index = flat_index
+    cloner_options = faiss.GpuClonerOptions()
+    if isinstance(cpu_index, faiss.IndexIVFPQ):
+        # IVF+PQ with 64 sub-quantizers needs float16 lookup tables to fit in GPU shared memory;
+        # the decoded flat index stays float32 so its search remains exact
+        cloner_options.useFloat16 = True
+    try:
+        return faiss.index_cpu_to_gpu(faiss.StandardGpuResources(), 0, cpu_index, cloner_options)
+    except Exception as e:
+        print(f"Could not move the FAISS index to GPU, using the CPU index: {e}")
+        return cpu_index
+
+RETRIEVER_K = 5 # Use 5 relevant chunks
+RETRIEVER_FETCH_K = 50 # Nearest neighbours fetched before the metadata post-filter
+
+@lru_cache(maxsize=32)
+def get_retriever(process=None, kind=None):
+    """
+    Returns a retriever (taking a query string) over the whole store, or, when a process/kind is given, one
+    that post-filters the nearest neighbours to chunks tagged with that process and document type plus
+    general reference material (e.g. regulations). If fewer than RETRIEVER_K chunks survive the filter,
+    it falls back to the unfiltered search.
+    """
+    if process is None:
+        return FilteredFallbackRetriever(vectorstore=get_db(), embeddings=get_embeddings(), k=RETRIEVER_K)
+
+    allowed_processes = {process, GENERAL_PROCESS}
+    allowed_kinds = {kind, REFERENCE_KIND}
+
+    def metadata_filter(metadata):
+        # Chunks from indexes built before metadata tagging count as general reference material
+        return (metadata.get("process", GENERAL_PROCESS) in allowed_processes
+                and metadata.get("kind", REFERENCE_KIND) in allowed_kinds)
+
+    # FAISS applies the filter after the ANN search, to the fetch_k nearest candidates
+    return FilteredFallbackRetriever(vectorstore=get_db(), embeddings=get_embeddings(), k=RETRIEVER_K,
+                                     fetch_k=RETRIEVER_FETCH_K, metadata_filter=metadata_filter)
+
+def warm_up():
+    """Loads the vector store when the page opens, so the first analysis doesn't wait for it."""
+    get_retriever()
+
+# --- 2. DOCUMENT CHECKLIST & PROCESS IDENTIFICATION ---
 def identify_process_and_missing_docs(file_paths):
     uploaded_docs = [os.path.basename(f.name).lower() for f in file_paths]
     process = "Company Incorporation"
     checklist = DOCUMENT_CHECKLISTS[process]
     
-    found_docs = {official_name for doc_name in uploaded_docs for keyword, official_name in checklist["documents"].items() if keyword in doc_name}
+    automaton = CHECKLIST_AUTOMATA[process]
+    found_docs = {official_name for doc_name in uploaded_docs for _, official_name in automaton.iter(doc_name)}
     
     missing_docs = [doc for doc in checklist["documents"].values() if doc not in found_docs]
     
@@ -63,28 +158,27 @@ def identify_process_and_missing_docs(file_paths):
     }
 
 # --- 3. DOCUMENT HIGHLIGHTING & COMMENTING ---
-def highlight_and_comment(doc, issue):
-    """Adds highlights and comments to the docx object for a single issue."""
-    text_to_find = issue.get("offending_text", "")
-    if not text_to_find:
-        return
-
-    comment_text = f"Issue: {issue.get('issue', 'N/A')}\nSuggestion: {issue.get('suggestion', 'N/A')}"
-    
-    for para in doc.paragraphs:
-        if text_to_find.lower() in para.text.lower():
-            # This is a simplified highlighting method. It might not preserve complex formatting within the paragraph.
-            # It works by re-building the paragraph run by run.
-            original_runs = para.runs
-            para.clear() # Clears the paragraph content but keeps formatting
-            
-            # Rebuild the paragraph, highlighting the target text
-            # This is a placeholder for a more robust highlighting logic
-            # A simple approach is to just color the whole paragraph's text
-            run = para.add_run(para.text)
-            run.font.color.rgb = RGBColor(255, 0, 0)
-            para.add_comment(comment_text, author="Corporate Agent")
-            return # Stop after the first find
+def highlight_and_comment(doc, para, original_text, matches):
+    """
+    Rebuilds a paragraph once, highlighting every matched span in red and commenting on each issue.
+    `matches` is a list of (start, end, issue) offsets into the paragraph's original text.
+    """
+    # Rebuilding from the captured text drops inline run formatting, but keeps the paragraph style
+    para.clear()
+    cursor = 0
+    highlighted_run = None
+    for start, end, issue in sorted(matches, key=lambda match: match[0]):
+        if start > cursor:
+            para.add_run(original_text[cursor:start])
+        if end > cursor:
+            highlighted_run = para.add_run(original_text[max(start, cursor):end])
+            highlighted_run.font.color.rgb = RGBColor(255, 0, 0)
+            cursor = end
+        # Overlapping issues share the most recent highlighted run
+        comment_text = f"Issue: {issue.get('issue', 'N/A')}\nSuggestion: {issue.get('suggestion', 'N/A')}"
+        doc.add_comment(highlighted_run, text=comment_text, author="Corporate Agent")
+    if cursor < len(original_text):
+        para.add_run(original_text[cursor:])
 
 def create_reviewed_docx(original_file, issues_found):
     """Creates a new .docx file with highlights and comments."""
@@ -92,83 +186,338 @@ def create_reviewed_docx(original_file, issues_found):
         return None
 
     doc = docx.Document(original_file.name)
-    
+
+    # Group issues by their (lowercased) offending text, so duplicates are located together
+    issues_by_text = {}
     for issue in issues_found:
-        highlight_and_comment(doc, issue)
+        text_to_find = (issue.get("offending_text") or "").lower()
+        if text_to_find:
+            issues_by_text.setdefault(text_to_find, []).append(issue)
+
+    if issues_by_text:
+        # Stream each paragraph through one automaton over all issue texts: a single pass per document
+        automaton = build_keyword_automaton({text: (text, issues) for text, issues in issues_by_text.items()})
+        located_texts = set()
+        for para in doc.paragraphs:
+            original_text = para.text
+            matches = []
+            for end_index, (text, issues) in automaton.iter(original_text.lower()):
+                if text in located_texts:
+                    continue # Each issue is highlighted at its first occurrence only
+                located_texts.add(text)
+                start = end_index - len(text) + 1
+                matches.extend((start, end_index + 1, issue) for issue in issues)
+            if matches:
+                highlight_and_comment(doc, para, original_text, matches)
+            if len(located_texts) == len(issues_by_text):
+                break
 
     base, ext = os.path.splitext(os.path.basename(original_file.name))
     reviewed_filename = f"Reviewed_{base}.docx"
     temp_dir = "temp_reviewed_docs"
-    if not os.path.exists(temp_dir):
-        os.makedirs(temp_dir)
+    os.makedirs(temp_dir, exist_ok=True) # Reviewed files are written from concurrent threads
     reviewed_filepath = os.path.join(temp_dir, reviewed_filename)
     
     doc.save(reviewed_filepath)
     return reviewed_filepath
 
-# --- 4. LANGCHAIN RAG ANALYSIS (Updated with LCEL) ---
-def analyze_document_with_langchain(doc_text, doc_name):
-    """Analyzes a document using the latest LangChain Expression Language (LCEL) retrieval chain."""
-    
-    prompt_template = """
-    You are an AI legal assistant specializing in Abu Dhabi Global Market (ADGM) regulations.
-    Your task is to review the legal document based on the provided context.
-
-    **Instructions:**
-    1. Use the **Provided ADGM Legal Context** below to ensure your analysis is accurate.
-    2. Identify legal red flags, missing clauses, and non-compliance issues.
-    3. For each issue, you MUST identify the specific text from the document that is problematic.
-    4. Return your findings ONLY in a structured JSON format. The JSON should be a list of objects. Do not add any text or explanation outside the JSON structure.
-
-    **JSON Output Format for each issue:**
-    {{
-      "section": "The clause or section number, e.g., 'Clause 3.1'",
-      "offending_text": "The exact text from the document that contains the issue.",
-      "issue": "A clear, one-sentence description of the issue found.",
-      "severity": "A severity rating: 'High', 'Medium', or 'Low'.",
-      "suggestion": "A compliant suggestion or an action to be taken.",
-      "citation": "The specific ADGM rule that applies, based on the context."
-    }}
-    
-    ---
-    **Provided ADGM Legal Context:**
-    {context}
-    ---
-    
-    Now, provide your analysis for the document.
+# --- 4. RESPONSE CACHES ---
+# Both cache layers live in one diskcache store (SQLite + mmap): O(1) per-key reads and writes,
+# safe to share between concurrent requests and Gradio workers.
+RESPONSE_CACHE_DIR = ".rag_cache"
+RESPONSE_CACHE_SIZE_LIMIT = int(2e9) # Bytes
+RESPONSE_CACHE_EXPIRE = 86400 * 7 # Seconds; keeps cached analyses in step with regulation updates
+response_cache = diskcache.Cache(RESPONSE_CACHE_DIR, size_limit=RESPONSE_CACHE_SIZE_LIMIT)
+
+# Exact cache: identical re-uploads are answered with an O(1) lookup, keyed ("prompt", sha256).
+def prompt_cache_key(doc_name, doc_text):
+    return hashlib.sha256((doc_name + "\0" + doc_text).encode("utf-8")).hexdigest()
+
+def lookup_prompt_cache(cache_key):
+    return response_cache.get(("prompt", cache_key))
+
+def store_prompt_cache(cache_key, issues):
+    response_cache.set(("prompt", cache_key), issues, expire=RESPONSE_CACHE_EXPIRE)
+
+# Semantic cache: re-uploaded or lightly edited documents embed to nearly the same vector, so we can reuse
+# the previous analysis instead of calling the LLM again. Entries are stored as ("semantic", sha256) ->
+# (embedding bytes, scope, issues); an in-memory FAISS index over the embeddings is rebuilt from them at startup.
+# The embedding model only reads the start of a long document, so a hit is restricted to the same scope
+# (document type, or file name for unrecognised documents) and must quote text that exists in the new document.
+SEMANTIC_CACHE_THRESHOLD = 0.95 # Minimum cosine similarity to count as a hit
+SEMANTIC_CACHE_CANDIDATES = 10 # Nearest entries checked for a matching scope
+EMBEDDING_DIM = 768 # Dimension of models/embedding-001
+
+def load_semantic_cache():
+    """Builds the in-memory similarity index from the semantic entries in the disk cache."""
+    index = faiss.IndexFlatIP(EMBEDDING_DIM)
+    entries = [] # (disk cache key, scope), aligned with the index ids
+    for key in response_cache.iterkeys():
+        if not (isinstance(key, tuple) and key[0] == "semantic"):
+            continue
+        entry = response_cache.get(key)
+        if entry is None or len(entry) != 3:
+            continue # Expired since iteration started, or written before scopes were stored
+        vector_bytes, scope, _ = entry
+        index.add(np.frombuffer(vector_bytes, dtype="float32").reshape(1, -1))
+        entries.append((key, scope))
+    return index, entries
+
+semantic_cache_index, semantic_cache_entries = load_semantic_cache()
+
+def semantic_cache_scope(doc_name, kind):
+    return kind if kind not in (None, REFERENCE_KIND) else doc_name
+
+@lru_cache(maxsize=256)
+def embed_query_cached(text):
+    """Embeds text as a unit-length vector, so inner product equals cosine similarity."""
+    vector = np.array([get_embeddings().embed_query(text)], dtype="float32")
+    faiss.normalize_L2(vector)
+    return vector
+
+def lookup_semantic_cache(query_vector, scope, doc_text):
     """
-    
-    prompt = PromptTemplate.from_template(prompt_template)
-    
-    # This is the modern way to create a RAG chain with LCEL
-    question_answer_chain = create_stuff_documents_chain(llm, prompt)
-    rag_chain = create_retrieval_chain(retriever, question_answer_chain)
+    Returns the cached issues of the closest previous document in the same scope, if it is similar enough,
+    not expired, and every cached offending_text also appears in `doc_text` (so it can still be highlighted).
+    """
+    if semantic_cache_index.ntotal == 0:
+        return None
+    lowered_text = doc_text.lower()
+    scores, ids = semantic_cache_index.search(query_vector, min(SEMANTIC_CACHE_CANDIDATES, semantic_cache_index.ntotal))
+    for score, entry_id in zip(scores[0], ids[0]):
+        if score < SEMANTIC_CACHE_THRESHOLD:
+            break # Results are sorted by similarity
+        key, entry_scope = semantic_cache_entries[entry_id]
+        if entry_scope != scope:
+            continue
+        entry = response_cache.get(key)
+        if entry is None:
+            continue
+        issues = entry[2]
+        if all((issue.get("offending_text") or "").lower() in lowered_text for issue in issues):
+            return issues
+    return None
+
+def store_semantic_cache(cache_key, query_vector, scope, issues):
+    key = ("semantic", cache_key)
+    response_cache.set(key, (query_vector.tobytes(), scope, issues), expire=RESPONSE_CACHE_EXPIRE)
+    semantic_cache_index.add(query_vector)
+    semantic_cache_entries.append((key, scope))
+
+# --- 5. LANGCHAIN RAG ANALYSIS (Updated with LCEL) ---
+RAG_PROMPT_TEMPLATE = """
+You are an AI legal assistant specializing in Abu Dhabi Global Market (ADGM) regulations.
+Review the document excerpt below, using the provided ADGM legal context to ensure your analysis is accurate.
+Identify legal red flags, missing clauses, and non-compliance issues, quoting the exact problematic text for each.
+
+---
+**Provided ADGM Legal Context:**
+{context}
+---
 
+**Document Excerpt to Review:**
+{input}
+---
+"""
+
+PRO_MODEL_MIN_CHARS = 20000 # Documents longer than this go straight to the Pro model
+
+def parse_issues(answer):
+    """Parses the LLM's JSON-mode answer into a list of issues, or returns None if it is not valid."""
     try:
-        # The input to the chain is a dictionary
-        response = rag_chain.invoke({"input": doc_text})
-        
-        # The LLM's answer is in the 'answer' key
-        answer = response.get("answer", "[]")
-        
-        # Clean the response to extract only the JSON part
-        json_start = answer.find('[')
-        json_end = answer.rfind(']') + 1
-        if json_start != -1 and json_end != -1:
-            clean_json = answer[json_start:json_end]
-            return json.loads(clean_json)
+        issues = json.loads(answer)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(issues, list) or not all(isinstance(issue, dict) for issue in issues):
+        return None
+    return issues
+
+def needs_escalation(issues):
+    """A Flash answer for a chunk is low-confidence if it is unparseable, or lists issues without any severity."""
+    return issues is None or (len(issues) > 0 and all(not issue.get("severity") for issue in issues))
+
+# Long documents are analyzed chunk by chunk: a chunk-sized query retrieves more precise context
+# than the whole document, and each prompt stays small.
+DOC_SPLITTER = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=100)
+MAX_CONCURRENT_CHUNKS = 4 # Per-document cap on simultaneous LLM calls
+
+def merge_issues(issue_lists):
+    """Concatenates per-chunk issues, dropping duplicates reported by overlapping chunks."""
+    merged = []
+    seen = set()
+    for issues in issue_lists:
+        for issue in issues:
+            key = (issue.get("section"), issue.get("offending_text"))
+            if key not in seen:
+                seen.add(key)
+                merged.append(issue)
+    return merged
+
+# The prompt and per-model answer chains are built once at import; only the retriever varies per request
+RAG_PROMPT = PromptTemplate.from_template(RAG_PROMPT_TEMPLATE)
+QUESTION_ANSWER_CHAINS = {
+    "flash": create_stuff_documents_chain(llm_flash, RAG_PROMPT),
+    "pro": create_stuff_documents_chain(llm_pro, RAG_PROMPT),
+}
+
+@lru_cache(maxsize=64)
+def get_rag_chain(tier, process=None, kind=None):
+    """Returns the (cached) LCEL retrieval chain for a model tier and retrieval filter."""
+    return build_rag_chain(get_retriever(process, kind), QUESTION_ANSWER_CHAINS[tier])
+
+async def run_rag_chain(rag_chain, doc_text):
+    """Runs the retrieval chain and returns the parsed issues (or None)."""
+    # The input to the chain is a dictionary; the LLM's answer is in the 'answer' key
+    response = await rag_chain.ainvoke({"input": doc_text})
+    return parse_issues(response.get("answer", "[]"))
+
+async def run_chunked_analysis(doc_text, process, kind, use_pro):
+    """
+    Analyzes each chunk of the document concurrently, escalating an individual chunk from Flash to Pro
+    when Flash fails or gives a weak answer for it. Returns (merged issues, chunk failures, chunk count).
+    """
+    flash_chain = get_rag_chain("flash", process, kind)
+    pro_chain = get_rag_chain("pro", process, kind)
+    chunks = DOC_SPLITTER.split_text(doc_text) or [doc_text]
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHUNKS)
+
+    async def analyze_chunk(chunk):
+        async with semaphore:
+            if not use_pro:
+                try:
+                    issues = await run_rag_chain(flash_chain, chunk)
+                except Exception as e:
+                    print(f"Flash analysis failed for a chunk, retrying with Pro: {e}")
+                    issues = None
+                if not needs_escalation(issues):
+                    return issues
+            issues = await run_rag_chain(pro_chain, chunk)
+            if issues is None:
+                raise ValueError("Could not parse LLM response.")
+            return issues
+
+    # Failures stay per chunk, so one bad chunk doesn't discard the others' results
+    results = await asyncio.gather(*(analyze_chunk(chunk) for chunk in chunks), return_exceptions=True)
+    chunk_issues = []
+    failures = []
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Error during LangChain analysis of a chunk: {result}")
+            failures.append(result)
         else:
-            return [{"issue": "Could not parse LLM response.", "severity": "Critical"}]
+            chunk_issues.append(result)
+    return merge_issues(chunk_issues), failures, len(chunks)
+
+async def analyze_document_with_langchain(doc_text, doc_name, process=None):
+    """Analyzes a document using the latest LangChain Expression Language (LCEL) retrieval chain."""
+
+    # Identical document seen before: return the stored analysis without touching the API
+    cache_key = prompt_cache_key(doc_name, doc_text)
+    cached_issues = lookup_prompt_cache(cache_key)
+    if cached_issues is not None:
+        return cached_issues
+
+    # The document type scopes both the semantic cache and the knowledge base search
+    kind = infer_kind(doc_name, process) if process else None
+    scope = semantic_cache_scope(doc_name, kind)
+
+    # Skip the LLM entirely if a near-identical document of the same type was already analyzed.
+    # The cache is only an optimization, so an embedding failure (quota, timeout) falls through to the LLM.
+    try:
+        query_vector = await asyncio.to_thread(embed_query_cached, normalize_text(doc_text))
+    except Exception as e:
+        print(f"Semantic cache unavailable, analyzing without it: {e}")
+        query_vector = None
+    if query_vector is not None:
+        cached_issues = lookup_semantic_cache(query_vector, scope, doc_text)
+        if cached_issues is not None:
+            store_prompt_cache(cache_key, cached_issues)
+            return cached_issues
+
+    try:
+        # Try the cheaper Flash model first (escalating weak chunks to Pro); long documents go straight to Pro
+        use_pro = len(doc_text) > PRO_MODEL_MIN_CHARS
+        issues, failures, chunk_count = await run_chunked_analysis(doc_text, process, kind, use_pro)
+        if not use_pro and not issues and not failures:
+            # Flash found nothing anywhere in the document: get a second opinion from Pro
+            issues, failures, chunk_count = await run_chunked_analysis(doc_text, process, kind, use_pro=True)
+
+        if len(failures) == chunk_count:
+            return [{"issue": f"Failed to analyze document due to an internal error: {failures[0]}", "severity": "Critical"}]
+        if failures:
+            # Report what was analyzed, flag the gap, and don't cache the incomplete result
+            issues.append({
+                "issue": f"{len(failures)} of {chunk_count} parts of the document could not be analyzed: {failures[0]}",
+                "severity": "High",
+                "suggestion": "Re-run the analysis to review the remaining parts."
+            })
+            return issues
+
+        if query_vector is not None:
+            store_semantic_cache(cache_key, query_vector, scope, issues)
+        store_prompt_cache(cache_key, issues)
+        return issues
 
     except Exception as e:
         print(f"Error during LangChain analysis: {e}")
         return [{"issue": f"Failed to analyze document due to an internal error: {e}", "severity": "Critical"}]
 
 
-# --- 5. MAIN GRADIO PROCESSING FUNCTION ---
-def process_documents(files):
+# --- 6. MAIN GRADIO PROCESSING FUNCTION ---
+def _read_docx(path):
+    """Extracts the text of a .docx file."""
+    doc = docx.Document(path)
+    return "\n".join(para.text for para in doc.paragraphs)
+
+def _read_docx_cached_sync(path):
+    """Returns a .docx file's text, reusing the cached parse when identical file bytes were seen before."""
+    with open(path, "rb") as f:
+        file_hash = hashlib.sha256(f.read()).hexdigest()
+    cached_text = response_cache.get(("parse", file_hash))
+    if cached_text is not None:
+        return cached_text
+
+    full_text = _read_docx(path)
+    # No expiry: a given file's text never changes, and the cache's size limit evicts old entries
+    response_cache.set(("parse", file_hash), full_text)
+    return full_text
+
+async def read_docx_cached(path):
+    """Runs the hashing, cache lookup, parse and cache store in a worker thread, off the event loop."""
+    return await asyncio.to_thread(_read_docx_cached_sync, path)
+
+async def analyze_uploaded_document(file_obj, read_text, process):
+    """Waits for one document's text, then analyzes it. Returns the document alongside its issues."""
+    doc_name = os.path.basename(file_obj.name)
+    try:
+        full_text = await read_text
+    except Exception as e:
+        return file_obj, doc_name, [{"issue": f"Could not read .docx file: {e}", "severity": "Critical"}]
+
+    try:
+        issues = await analyze_document_with_langchain(full_text, doc_name, process)
+    except Exception as e:
+        print(f"Error during LangChain analysis: {e}")
+        issues = [{"issue": f"Failed to analyze document due to an internal error: {e}", "severity": "Critical"}]
+    return file_obj, doc_name, issues
+
+def build_report(checklist_result, all_issues):
+    return {
+        "process": checklist_result["process"],
+        "documents_uploaded": checklist_result["documents_uploaded_count"],
+        "required_documents": checklist_result["required_documents_count"],
+        "missing_document(s)": checklist_result["missing_documents"],
+        "issues_found": all_issues
+    }
+
+async def process_documents(files):
+    """
+    Async generator for Gradio: yields the checklist result immediately, then an updated report
+    each time a document's analysis finishes, instead of blocking until every document is done.
+    """
     if files is None:
-        return "Please upload documents to begin.", None, None
+        yield "Please upload documents to begin.", None, None
+        return
         
     checklist_result = identify_process_and_missing_docs(files)
     
@@ -185,38 +534,31 @@ def process_documents(files):
 
     all_issues = []
     reviewed_file_paths = []
+
+    # Show the checklist status while the documents are still being read and analyzed
+    yield checklist_notification, build_report(checklist_result, []), []
     
-    for file_obj in files:
-        doc_name = os.path.basename(file_obj.name)
-        try:
-            doc = docx.Document(file_obj.name)
-            full_text = "\n".join([para.text for para in doc.paragraphs])
-        except Exception as e:
-            all_issues.append({"document": doc_name, "issue": f"Could not read .docx file: {e}", "severity": "Critical"})
-            continue
-            
-        issues = analyze_document_with_langchain(full_text, doc_name)
+    # Parse the .docx files in worker threads so the XML parsing doesn't block the event loop, skipping
+    # files whose bytes were already parsed. Each document's LLM call starts as soon as its own text is
+    # ready, overlapping with the other parses. (Threads rather than processes: a spawned worker would
+    # re-import this whole module, and forking a process that runs the server's threads is unsafe.)
+    tasks = [analyze_uploaded_document(file_obj, read_docx_cached(file_obj.name), checklist_result["process"]) for file_obj in files]
+    for next_result in asyncio.as_completed(tasks):
+        file_obj, doc_name, issues = await next_result
         
         if issues:
             for issue in issues:
                 issue['document'] = doc_name
             all_issues.extend(issues)
             
-            reviewed_path = create_reviewed_docx(file_obj, issues)
+            # Re-parsing and saving the reviewed .docx is blocking work too
+            reviewed_path = await asyncio.to_thread(create_reviewed_docx, file_obj, issues)
             if reviewed_path:
                 reviewed_file_paths.append(reviewed_path)
 
-    final_report = {
-        "process": checklist_result["process"],
-        "documents_uploaded": checklist_result["documents_uploaded_count"],
-        "required_documents": checklist_result["required_documents_count"],
-        "missing_document(s)": checklist_result["missing_documents"],
-        "issues_found": all_issues
-    }
-    
-    return checklist_notification, final_report, reviewed_file_paths
+        yield checklist_notification, build_report(checklist_result, list(all_issues)), list(reviewed_file_paths)
 
-# --- 6. GRADIO UI ---
+# --- 7. GRADIO UI ---
 with gr.Blocks(theme=gr.themes.Soft()) as demo:
     gr.Markdown("# 🤖 ADGM-Compliant Corporate Agent (LangChain & FAISS)")
     gr.Markdown("This AI assistant uses a RAG architecture to analyze legal documents against ADGM regulations, providing comments and highlights directly in the file.")
@@ -238,6 +580,8 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
             json_output = gr.JSON(label="Structured Analysis Report")
             reviewed_files_output = gr.File(label="Download Reviewed Documents (with Highlights & Comments)", file_count="multiple", interactive=False)
 
+    demo.load(fn=warm_up)
+
     submit_btn.click(
         fn=process_documents,
         inputs=file_uploads,
@@ -0,0 +1,49 @@
+import os
+import ahocorasick
+
+# --- DOCUMENT CHECKLISTS ---
+# Shared by the app (checklist verification, retrieval filters) and the vector store builder (chunk metadata).
+DOCUMENT_CHECKLISTS = {
+    "Company Incorporation": {
+        "required_count": 5,
+        "documents": {
+            "articles of association": "Articles of Association",
+            "memorandum of association": "Memorandum of Association (MoA/MoU)",
+            "incorporation application form": "Incorporation Application Form",
+            "ubo declaration form": "UBO Declaration Form",
+            "register of members and directors": "Register of Members and Directors"
+        }
+    }
+}
+
+# Metadata for knowledge base files that don't belong to a specific process or document type (e.g. regulations)
+GENERAL_PROCESS = "General"
+REFERENCE_KIND = "Reference"
+
+def build_keyword_automaton(keywords):
+    """Builds an Aho-Corasick automaton mapping each keyword to its value (e.g. an official document name)."""
+    automaton = ahocorasick.Automaton()
+    for keyword, value in keywords.items():
+        automaton.add_word(keyword, value)
+    automaton.make_automaton()
+    return automaton
+
+# One automaton per process, so each filename is matched against all keywords in a single pass
+CHECKLIST_AUTOMATA = {process: build_keyword_automaton(checklist["documents"]) for process, checklist in DOCUMENT_CHECKLISTS.items()}
+
+def infer_process(file_name):
+    """Returns the process whose checklist mentions this file, or GENERAL_PROCESS."""
+    name = os.path.basename(file_name).lower()
+    for process, automaton in CHECKLIST_AUTOMATA.items():
+        for _ in automaton.iter(name):
+            return process
+    return GENERAL_PROCESS
+
+def infer_kind(file_name, process=None):
+    """Returns the official document name this file matches (within `process`, if given), or REFERENCE_KIND."""
+    name = os.path.basename(file_name).lower()
+    processes = [process] if process in CHECKLIST_AUTOMATA else list(CHECKLIST_AUTOMATA)
+    for candidate in processes:
+        for _, official_name in CHECKLIST_AUTOMATA[candidate].iter(name):
+            return official_name
+    return REFERENCE_KIND
@@ -1,9 +1,16 @@
 import os
+import math
+from concurrent.futures import ThreadPoolExecutor
+import faiss
+import numpy as np
 from dotenv import load_dotenv
 from langchain_community.document_loaders import Docx2txtLoader, PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+
+from checklists import infer_process, infer_kind
 
 # --- CONFIGURATION ---
 load_dotenv()
@@ -15,6 +22,48 @@ if not os.getenv("GOOGLE_API_KEY"):
 # Directory containing the knowledge base files
 DATA_SOURCE_DIR = './templates_for_db/'
 
+# Embedding settings
+EMBEDDING_BATCH_SIZE = 100 # Texts sent per embedding API call
+EMBEDDING_WORKERS = 8 # Concurrent embedding API calls, kept low to respect Google's rate limit
+
+# Index settings
+MIN_VECTORS_FOR_IVFPQ = 10000 # Below this a full int8 scan is fast and IVF/PQ training would be under-fit
+PQ_SUBQUANTIZERS = 64 # Bytes stored per vector (768 floats * 4 bytes -> 64 bytes)
+PQ_BITS = 8
+IVF_NPROBE = 8 # Number of inverted lists scanned per query; saved with the index, so app.py picks it up on load
+
+def embed_in_batches(embeddings, texts):
+    """Embeds texts in large batches, overlapping the API calls across a small thread pool."""
+    batches = [texts[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+    print(f"Embedding {len(texts)} chunks in {len(batches)} batches...")
+    with ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS) as executor:
+        # map() preserves batch order, so vectors stay aligned with texts
+        vectors = []
+        for batch_vectors in executor.map(embeddings.embed_documents, batches):
+            vectors.extend(batch_vectors)
+    return np.array(vectors, dtype="float32")
+
+def build_faiss_index(vectors):
+    """
+    Builds a trained (but still empty) FAISS index for the given vectors.
+    Uses IVF+PQ for sub-linear, compressed search on large corpora. Smaller corpora get a full scan
+    over int8 scalar-quantized vectors, which is 4x smaller than float32 with negligible recall loss.
+    """
+    num_vectors, dim = vectors.shape
+    if num_vectors < MIN_VECTORS_FOR_IVFPQ:
+        print(f"Only {num_vectors} chunks, using an int8 scalar-quantized index.")
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+        index.train(vectors)
+        return index
+
+    nlist = int(4 * math.sqrt(num_vectors))
+    print(f"Training IVF+PQ index with {nlist} lists...")
+    quantizer = faiss.IndexFlatL2(dim)
+    index = faiss.IndexIVFPQ(quantizer, dim, nlist, PQ_SUBQUANTIZERS, PQ_BITS)
+    index.train(vectors)
+    index.nprobe = IVF_NPROBE
+    return index
+
 # --- SCRIPT LOGIC ---
 def create_vector_store():
     """
@@ -46,13 +95,18 @@ def create_vector_store():
             if file_name.lower().endswith(".pdf"):
                 loader = PyPDFLoader(file_path)
                 print(f"   - Loading PDF: {file_name}")
-                all_docs.extend(loader.load())
             elif file_name.lower().endswith(".docx"):
                 loader = Docx2txtLoader(file_path)
                 print(f"   - Loading DOCX: {file_name}")
-                all_docs.extend(loader.load())
             else:
                 print(f"   - Skipping non-supported file: {file_name}")
+                continue
+
+            # Tag each page/section so the app can filter retrieved chunks by process and document type
+            loaded_docs = loader.load()
+            for doc in loaded_docs:
+                doc.metadata.update({"process": infer_process(file_name), "kind": infer_kind(file_name)})
+            all_docs.extend(loaded_docs)
         except Exception as e:
             print(f"   - ❌ Error loading {file_name}: {e}")
 
@@ -78,7 +132,13 @@ def create_vector_store():
     # 4. Create the FAISS vector store
     print("Creating FAISS vector store... (This might take a few minutes)")
     try:
-        db = FAISS.from_documents(split_docs, embeddings)
+        texts = [doc.page_content for doc in split_docs]
+        metadatas = [doc.metadata for doc in split_docs]
+        vectors = embed_in_batches(embeddings, texts)
+
+        index = build_faiss_index(vectors)
+        db = FAISS(embedding_function=embeddings, index=index, docstore=InMemoryDocstore(), index_to_docstore_id={})
+        db.add_embeddings(list(zip(texts, vectors.tolist())), metadatas=metadatas)
     except Exception as e:
         print(f"❌ An error occurred during FAISS index creation: {e}")
         return
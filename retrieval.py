@@ -0,0 +1,57 @@
+import asyncio
+import re
+from operator import itemgetter
+from typing import Any, Callable, List, Optional
+from langchain.chains import create_retrieval_chain
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableLambda
+
+# --- RETRIEVAL HELPERS ---
+# Kept free of API keys, models and index loading, so the chain wiring can be tested on its own.
+
+def normalize_text(text):
+    """
+    Collapses runs of spaces and blank lines, which blur query embeddings. Only used for embedding and
+    retrieval queries: the LLM must see the raw text so its quoted offending_text matches the .docx paragraphs.
+    """
+    text = re.sub(r"[ \t]+", " ", text)
+    text = re.sub(r"\n\s*\n+", "\n\n", text)
+    return text.strip()
+
+class FilteredFallbackRetriever(BaseRetriever):
+    """
+    Retrieves `k` chunks for a query string from a vector store, optionally post-filtering the `fetch_k`
+    nearest neighbours by metadata. The query is embedded once: if fewer than `k` chunks survive the
+    filter, the same vector is searched again without it, so the LLM never runs short of context.
+    """
+    vectorstore: Any
+    embeddings: Any
+    k: int = 5
+    fetch_k: int = 50
+    metadata_filter: Optional[Callable[[dict], bool]] = None
+
+    def _search(self, vector):
+        if self.metadata_filter is not None:
+            docs = self.vectorstore.similarity_search_by_vector(vector, k=self.k, filter=self.metadata_filter, fetch_k=self.fetch_k)
+            if len(docs) >= self.k:
+                return docs
+        return self.vectorstore.similarity_search_by_vector(vector, k=self.k)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self._search(self.embeddings.embed_query(query))
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        vector = await self.embeddings.aembed_query(query)
+        return await asyncio.to_thread(self._search, vector) # The FAISS search itself is blocking CPU work
+
+def build_rag_chain(retriever, question_answer_chain):
+    """
+    Builds the LCEL retrieval chain. The retriever receives the whitespace-normalized `input` string,
+    while the answer chain still sees the raw `input`.
+    """
+    # create_retrieval_chain passes the whole input dict to anything that isn't a BaseRetriever,
+    # so select the query string before normalizing it
+    retrieval_query = itemgetter("input") | RunnableLambda(normalize_text)
+    return create_retrieval_chain(retrieval_query | retriever, question_answer_chain)
@@ -0,0 +1,102 @@
+import asyncio
+from typing import List
+
+from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain.prompts import PromptTemplate
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.retrievers import BaseRetriever
+
+from retrieval import FilteredFallbackRetriever, build_rag_chain, normalize_text
+
+
+class RecordingRetriever(BaseRetriever):
+    """Returns a fixed context chunk and records every query it receives."""
+    queries: List[str] = []
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        self.queries.append(query)
+        return [Document(page_content="ADGM Companies Regulations 2020, s.15")]
+
+
+def build_chain(answer):
+    retriever = RecordingRetriever()
+    prompt = PromptTemplate.from_template("Context: {context}\nDocument: {input}")
+    llm = FakeListChatModel(responses=[answer])
+    return build_rag_chain(retriever, create_stuff_documents_chain(llm, prompt)), retriever
+
+
+def test_normalize_text_collapses_spaces_and_blank_lines():
+    assert normalize_text("  1.1\tThe  Company\n\n\n\nshall  ") == "1.1 The Company\n\nshall"
+
+
+def test_rag_chain_passes_normalized_query_string_to_retriever():
+    chain, retriever = build_chain('[{"issue": "x"}]')
+
+    response = chain.invoke({"input": "1.1\tThe  Company"})
+
+    assert retriever.queries == ["1.1 The Company"]
+    assert response["answer"] == '[{"issue": "x"}]'
+    assert response["context"][0].page_content == "ADGM Companies Regulations 2020, s.15"
+
+
+def test_rag_chain_ainvoke_passes_normalized_query_string_to_retriever():
+    chain, retriever = build_chain("[]")
+
+    response = asyncio.run(chain.ainvoke({"input": "Clause  3.1"}))
+
+    assert retriever.queries == ["Clause 3.1"]
+    assert response["answer"] == "[]"
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [0.0, 1.0]
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+
+class FakeVectorStore:
+    """Serves `filtered` for filtered searches and `unfiltered` otherwise, recording each search."""
+
+    def __init__(self, filtered, unfiltered):
+        self.filtered = filtered
+        self.unfiltered = unfiltered
+        self.searches = []
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, fetch_k=20):
+        self.searches.append("filtered" if filter else "unfiltered")
+        docs = self.filtered if filter else self.unfiltered
+        return docs[:k]
+
+
+def docs(*names):
+    return [Document(page_content=name) for name in names]
+
+
+def test_filtered_retriever_keeps_filtered_results_when_enough_survive():
+    store = FakeVectorStore(filtered=docs("a", "b"), unfiltered=docs("x", "y"))
+    embeddings = CountingEmbeddings()
+    retriever = FilteredFallbackRetriever(vectorstore=store, embeddings=embeddings, k=2, metadata_filter=lambda metadata: True)
+
+    assert [doc.page_content for doc in retriever.invoke("query")] == ["a", "b"]
+    assert store.searches == ["filtered"]
+    assert embeddings.calls == 1
+
+
+def test_filtered_retriever_falls_back_to_unfiltered_search_with_one_embedding():
+    store = FakeVectorStore(filtered=docs("a"), unfiltered=docs("x", "y"))
+    embeddings = CountingEmbeddings()
+    retriever = FilteredFallbackRetriever(vectorstore=store, embeddings=embeddings, k=2, metadata_filter=lambda metadata: True)
+
+    result = asyncio.run(retriever.ainvoke("query"))
+
+    assert [doc.page_content for doc in result] == ["x", "y"]
+    assert store.searches == ["filtered", "unfiltered"]
+    assert embeddings.calls == 1